@@ -0,0 +1,101 @@
+"""Concurrent login throughput with bcrypt inline on the event loop vs. on the hasher pool.
+
+    python -m benchmarks.bench_password_hashing --logins 64 --concurrency 16
+"""
+
+import argparse
+import asyncio
+import json
+import statistics
+import time
+
+import httpx
+from fastapi import FastAPI
+from tortoise import Tortoise
+
+from user import api
+from user.models import User
+from user.passwords import hasher, pwd_context
+
+
+async def inline_verify(plain_password, hashed_password):
+    # what the handlers did before: bcrypt straight on the event loop
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+async def run(mode, logins, concurrency):
+    app = FastAPI()
+    app.include_router(api.app)
+    api.verify_password = inline_verify if mode == 'inline' else pooled_verify
+
+    await Tortoise.init(db_url='sqlite://:memory:', modules={'models': ['user.models']})
+    await Tortoise.generate_schemas()
+    await User.create(email='bench@example.com', name='bench', phone='9999999999',
+                      password=pwd_context.hash('secret'))
+
+    transport = httpx.ASGITransport(app=app)
+    semaphore = asyncio.Semaphore(concurrency)
+    login_times, lag_times = [], []
+    rejected = 0
+    done = asyncio.Event()
+
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        async def login():
+            nonlocal rejected
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.post('/login/', json={'email': 'bench@example.com',
+                                                              'password': 'secret'})
+                if response.status_code == 503:
+                    rejected += 1
+                    return
+                response.raise_for_status()
+                login_times.append(time.perf_counter() - started)
+
+        async def probe():
+            # how late a 10ms timer fires is how long any other request would have stalled
+            while not done.is_set():
+                started = time.perf_counter()
+                await asyncio.sleep(0.01)
+                lag_times.append(time.perf_counter() - started - 0.01)
+
+        probe_task = asyncio.create_task(probe())
+        started = time.perf_counter()
+        await asyncio.gather(*(login() for _ in range(logins)))
+        elapsed = time.perf_counter() - started
+        done.set()
+        await probe_task
+
+    await Tortoise.close_connections()
+    return {
+        'mode': mode,
+        'logins': logins,
+        'concurrency': concurrency,
+        'rejected': rejected,
+        'logins_per_sec': round(len(login_times) / elapsed, 2),
+        'login_p50_ms': round(statistics.median(login_times) * 1000, 2),
+        'loop_lag_p50_ms': round(statistics.median(lag_times) * 1000, 2),
+        'loop_lag_max_ms': round(max(lag_times) * 1000, 2),
+    }
+
+
+pooled_verify = api.verify_password
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--logins', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=None, help='hasher pool size')
+    args = parser.parse_args()
+    if args.workers:
+        hasher.max_workers = args.workers
+    # let every benchmark login queue; shedding is not what is being measured here
+    hasher.max_pending = max(hasher.max_pending, args.concurrency)
+    for mode in ('inline', 'pool'):
+        print(json.dumps(asyncio.run(run(mode, args.logins, args.concurrency))))
+    hasher.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""Serialization throughput of the user list response, before and after the orjson path.
+
+    python -m benchmarks.bench_serialization --sizes 1000 10000 100000
+"""
+
+import argparse
+import json
+import time
+from typing import List
+
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import TypeAdapter
+
+from user.models import User
+from user.pydentic_modules import UserOut
+
+users_adapter = TypeAdapter(List[UserOut])
+
+
+def make_rows(size):
+    return [{'id': i, 'email': f'user{i}@example.com', 'name': f'user {i}', 'phone': f'{i:010d}'}
+            for i in range(1, size + 1)]
+
+
+def models_jsonable_encoder(rows, models):
+    # before: User.all() model instances through jsonable_encoder and JSONResponse's json.dumps
+    return json.dumps(jsonable_encoder(models), ensure_ascii=False, separators=(',', ':')).encode()
+
+def values_orjson(rows, models):
+    # after: .values() dicts straight into ORJSONResponse
+    return orjson.dumps(rows)
+
+def values_pydantic(rows, models):
+    # for comparison: validating against the response model and dumping in pydantic-core
+    return users_adapter.dump_json(users_adapter.validate_python(rows))
+
+
+CASES = (models_jsonable_encoder, values_orjson, values_pydantic)
+
+
+def measure(case, rows, models, min_seconds):
+    runs = 0
+    started = time.perf_counter()
+    while True:
+        case(rows, models)
+        runs += 1
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_seconds:
+            return elapsed / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--min-seconds', type=float, default=1.0)
+    args = parser.parse_args()
+    for size in args.sizes:
+        rows = make_rows(size)
+        models = [User._init_from_db(password='x' * 60, **row) for row in rows]
+        baseline = None
+        for case in CASES:
+            seconds = measure(case, rows, models, args.min_seconds)
+            baseline = baseline or seconds
+            print(json.dumps({
+                'case': case.__name__,
+                'users': size,
+                'ms_per_response': round(seconds * 1000, 3),
+                'users_per_sec': round(size / seconds),
+                'speedup': round(baseline / seconds, 2),
+            }))
+
+
+if __name__ == '__main__':
+    main()
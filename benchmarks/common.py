@@ -0,0 +1,68 @@
+"""Helpers shared by the benchmarks: booting main.app against a throwaway database and seeding users."""
+
+import os
+import random
+import statistics
+
+SYLLABLES = ('al', 'an', 'ar', 'be', 'ca', 'da', 'el', 'fi', 'ja', 'ka', 'li', 'ma', 'mo', 'na',
+             'pa', 'ra', 'ri', 'sa', 'se', 'ta', 'to', 'va', 'vi', 'ya', 'za')
+
+
+def use_database(db_url):
+    # must run before main/settings are imported
+    os.environ['DB_URL'] = db_url
+    os.environ.setdefault('GENERATE_SCHEMAS', 'true')
+
+
+async def start_app():
+    from main import app
+    await app.router.startup()
+    return app
+
+
+async def stop_app(app):
+    await app.router.shutdown()
+
+
+def user_name(index):
+    rng = random.Random(index)
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))).capitalize()
+
+
+def user_phone(index):
+    # 10 digits without a leading zero, so it survives the int phone field of the api payloads
+    return str(1000000000 + index)
+
+
+def user_row(index, password_hash):
+    return {'email': f'user{index}@example.com', 'name': user_name(index),
+            'phone': user_phone(index), 'password': password_hash}
+
+
+async def seed_users(count, start=0, batch_size=10000):
+    """Insert `count` users sharing one precomputed bcrypt hash of 'secret'."""
+    from user.models import User
+    from user.passwords import pwd_context
+    password_hash = pwd_context.hash('secret')
+    for offset in range(start, start + count, batch_size):
+        stop = min(offset + batch_size, start + count)
+        await User.bulk_create([User(**user_row(index, password_hash)) for index in range(offset, stop)],
+                               batch_size=batch_size)
+
+
+def summarize(name, latencies, elapsed, errors=0, statuses=None):
+    if len(latencies) > 1:
+        quantiles = [round(q * 1000, 3) for q in statistics.quantiles(latencies, n=100, method='inclusive')]
+    else:
+        # one sample stands for every percentile; with none they are null
+        quantiles = [round(q * 1000, 3) for q in latencies] * 99 or [None] * 99
+    return {
+        'endpoint': name,
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'requests_per_sec': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'p50_ms': quantiles[49],
+        'p95_ms': quantiles[94],
+        'p99_ms': quantiles[98],
+        **({'statuses': statuses} if statuses is not None else {}),
+    }
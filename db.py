@@ -0,0 +1,82 @@
+# tortoise configuration and pool introspection
+#
+# run `python db.py` to create the tables once, instead of on every worker boot; it also
+# adds unique indexes that generate_schemas cannot add to a table created before them
+
+from tortoise import Tortoise, connections, run_async
+from tortoise.backends.base.config_generator import expand_db_url
+
+from settings import settings
+
+MODULES = {'models': ['user.models']}
+# (table, column) pairs made unique after their table may already have been created
+LATER_UNIQUE_COLUMNS = (('user', 'phone'),)
+
+
+def tortoise_config(settings=settings):
+    connection = expand_db_url(settings.db_url)
+    if connection['engine'] == 'tortoise.backends.asyncpg':
+        connection['credentials'].update(
+            minsize=settings.db_pool_min_size,
+            maxsize=settings.db_pool_max_size,
+            statement_cache_size=settings.db_statement_cache_size,
+            command_timeout=settings.db_command_timeout,
+            max_inactive_connection_lifetime=settings.db_max_inactive_connection_lifetime,
+        )
+    return {
+        'connections': {'default': connection},
+        'apps': {'models': {'models': MODULES['models'], 'default_connection': 'default'}},
+    }
+
+
+def pool_stats():
+    connection = connections.get('default')
+    pool = getattr(connection, '_pool', None)
+    if pool is None:
+        # sqlite and other single-connection backends
+        return {'pooled': False}
+    size = pool.get_size()
+    idle = pool.get_idle_size()
+    return {
+        'pooled': True,
+        'min_size': pool.get_min_size(),
+        'max_size': pool.get_max_size(),
+        'size': size,
+        'in_use': size - idle,
+        'idle': idle,
+        'utilization': round((size - idle) / pool.get_max_size(), 4),
+    }
+
+
+async def _has_unique_index(connection, table, column):
+    if connection.capabilities.dialect != 'sqlite':
+        # postgres names a column's UNIQUE constraint <table>_<column>_key, which
+        # CREATE UNIQUE INDEX IF NOT EXISTS below skips
+        return False
+    for index in await connection.execute_query_dict(f'PRAGMA index_list("{table}")'):
+        columns = await connection.execute_query_dict(f'PRAGMA index_info("{index["name"]}")')
+        if index['unique'] and [row['name'] for row in columns] == [column]:
+            return True
+    return False
+
+
+async def add_unique_indexes():
+    """Add the unique indexes of LATER_UNIQUE_COLUMNS to tables that predate them.
+
+    Fails with an IntegrityError while the column still holds duplicates; remove those first.
+    """
+    connection = connections.get('default')
+    for table, column in LATER_UNIQUE_COLUMNS:
+        if not await _has_unique_index(connection, table, column):
+            await connection.execute_script(
+                f'CREATE UNIQUE INDEX IF NOT EXISTS "{table}_{column}_key" ON "{table}" ("{column}")')
+
+
+async def generate_schemas():
+    await Tortoise.init(config=tortoise_config())
+    await Tortoise.generate_schemas()
+    await add_unique_indexes()
+
+
+if __name__ == '__main__':
+    run_async(generate_schemas())
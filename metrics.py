@@ -0,0 +1,228 @@
+# request metrics: per-route latency histograms, in-flight requests and DB queries per request,
+# served in prometheus text format at /metrics
+
+import functools
+import logging
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from starlette.routing import Match
+from tortoise import connections
+from tortoise.backends.base.client import BaseDBAsyncClient
+
+from db import pool_stats
+from user.cache import user_cache
+from user.passwords import hasher
+
+logger = logging.getLogger('metrics.slow_requests')
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_METHODS = ('execute_insert', 'execute_many', 'execute_query', 'execute_query_dict', 'execute_script')
+
+# fields of hasher.stats(), user_cache.stats() and pool_stats() exported as
+# <prefix>_<field>; counters get the _total suffix, other fields are skipped
+SERVICE_METRICS = {
+    'password_hasher': (
+        ('max_workers', 'gauge', 'Size of the bcrypt worker pool.'),
+        ('max_pending', 'gauge', 'Password jobs admitted before new ones get a 503.'),
+        ('pending', 'gauge', 'Password jobs queued or running.'),
+        ('running', 'gauge', 'Password jobs running on a worker.'),
+        ('queue_depth', 'gauge', 'Password jobs waiting for a worker.'),
+        ('completed', 'counter', 'Password jobs finished.'),
+        ('rejected', 'counter', 'Password jobs refused with a 503.'),
+        ('avg_wait_ms', 'gauge', 'Mean time a password job waited for a worker, since start.'),
+        ('avg_run_ms', 'gauge', 'Mean bcrypt time per password job, since start.'),
+        ('max_run_ms', 'gauge', 'Longest bcrypt time of a password job, since start.'),
+    ),
+    'user_cache': (
+        ('hits', 'counter', 'User lookups answered from the cache.'),
+        ('negative_hits', 'counter', 'Lookups of missing users answered from the cache.'),
+        ('misses', 'counter', 'User lookups that queried the database.'),
+        ('hit_ratio', 'gauge', 'Share of user lookups answered from the cache, since start.'),
+        ('size', 'gauge', 'Entries in the user cache.'),
+        ('max_size', 'gauge', 'Entries the user cache holds before evicting.'),
+        ('evictions', 'counter', 'User cache entries evicted to stay under max_size.'),
+    ),
+    'db_pool': (
+        ('min_size', 'gauge', 'Minimum connections kept by the pool.'),
+        ('max_size', 'gauge', 'Maximum connections of the pool.'),
+        ('size', 'gauge', 'Connections open in the pool.'),
+        ('in_use', 'gauge', 'Pool connections checked out.'),
+        ('idle', 'gauge', 'Pool connections idle.'),
+        ('utilization', 'gauge', 'Share of max_size checked out.'),
+    ),
+}
+
+# queries of the request being handled, as (sql, seconds); None outside a request
+_queries = ContextVar('request_queries', default=None)
+# set while a query is timed, so a client method calling another is counted once
+_in_query = ContextVar('in_query', default=False)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[index] += 1
+
+
+class Metrics:
+    def __init__(self):
+        self.latency = defaultdict(Histogram)
+        self.requests = defaultdict(int)
+        self.in_flight = defaultdict(int)
+        self.queries = defaultdict(int)
+        self.query_seconds = defaultdict(float)
+        self.query_histogram = defaultdict(lambda: Histogram(buckets=(0, 1, 2, 3, 5, 10, 25, 50, 100)))
+
+    def render(self):
+        lines = []
+
+        def histogram(name, help, histograms):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} histogram')
+            for (method, route), hist in sorted(histograms.items()):
+                labels = f'method="{method}",route="{route}"'
+                for bound, count in zip(hist.buckets, hist.counts):
+                    lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {hist.count}')
+                lines.append(f'{name}_sum{{{labels}}} {hist.sum}')
+                lines.append(f'{name}_count{{{labels}}} {hist.count}')
+
+        def metric(name, type, help, values, label_names=('method', 'route')):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {type}')
+            for key, value in sorted(values.items()):
+                labels = ','.join(f'{label}="{part}"' for label, part in zip(label_names, key))
+                lines.append(f'{name}{{{labels}}} {value}')
+
+        histogram('http_request_duration_seconds', 'Request latency by route.', self.latency)
+        metric('http_requests_total', 'counter', 'Requests by route and status code.', self.requests,
+               ('method', 'route', 'status'))
+        metric('http_requests_in_flight', 'gauge', 'Requests currently being handled.', self.in_flight)
+        histogram('http_request_db_queries', 'SQL queries issued per request.', self.query_histogram)
+        metric('http_request_db_queries_total', 'counter', 'SQL queries issued by route.', self.queries)
+        metric('http_request_db_seconds_total', 'counter', 'Time spent in SQL by route.', self.query_seconds)
+
+        for prefix, stats in (('password_hasher', hasher.stats()),
+                              ('user_cache', user_cache.stats()),
+                              ('db_pool', pool_stats())):
+            for key, type, help in SERVICE_METRICS[prefix]:
+                value = stats.get(key)
+                # absent (sqlite has no pool, a shared cache backend has no size) or not a number
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                name = f'{prefix}_{key}_total' if type == 'counter' else f'{prefix}_{key}'
+                lines.append(f'# HELP {name} {help}')
+                lines.append(f'# TYPE {name} {type}')
+                lines.append(f'{name} {float(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def _route_of(scope):
+    partial = None
+    for route in scope['app'].routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+        if match == Match.PARTIAL and partial is None:
+            partial = route.path
+    return partial or '<unmatched>'
+
+
+class MetricsMiddleware:
+    def __init__(self, app, slow_request_ms=None):
+        self.app = app
+        self.slow_request_ms = slow_request_ms
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        key = (scope['method'], _route_of(scope))
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
+        queries = []
+        token = _queries.set(queries)
+        metrics.in_flight[key] += 1
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            metrics.in_flight[key] -= 1
+            _queries.reset(token)
+            metrics.latency[key].observe(elapsed)
+            metrics.requests[key + (status_code,)] += 1
+            metrics.queries[key] += len(queries)
+            metrics.query_seconds[key] += sum(seconds for _, seconds in queries)
+            metrics.query_histogram[key].observe(len(queries))
+            if self.slow_request_ms is not None and elapsed * 1000 >= self.slow_request_ms:
+                logger.warning('%s %s took %.1fms with %d queries:\n%s', key[0], scope['path'], elapsed * 1000,
+                               len(queries), '\n'.join(f'  {seconds * 1000:.2f}ms {sql}' for sql, seconds in queries))
+
+
+def _timed_query(method):
+    @functools.wraps(method)
+    async def wrapper(self, query, *args, **kwargs):
+        queries = _queries.get()
+        if queries is None or _in_query.get():
+            return await method(self, query, *args, **kwargs)
+        token = _in_query.set(True)
+        started = time.perf_counter()
+        try:
+            return await method(self, query, *args, **kwargs)
+        finally:
+            queries.append((query, time.perf_counter() - started))
+            _in_query.reset(token)
+    wrapper.timed = True
+    return wrapper
+
+
+def _subclasses(cls):
+    yield cls
+    for subclass in cls.__subclasses__():
+        yield from _subclasses(subclass)
+
+
+def instrument_connections():
+    """Wrap the query methods of every client class in use, including its transaction wrappers."""
+    classes = set()
+    for connection in connections.all():
+        for cls in type(connection).__mro__:
+            if issubclass(cls, BaseDBAsyncClient):
+                classes.add(cls)
+        classes.update(_subclasses(type(connection)))
+    for cls in classes:
+        for name in QUERY_METHODS:
+            method = cls.__dict__.get(name)
+            if method is not None and not getattr(method, 'timed', False):
+                setattr(cls, name, _timed_query(method))
+
+
+router = APIRouter()
+
+
+@router.get('/metrics', response_class=PlainTextResponse, include_in_schema=False)
+async def metrics_endpoint():
+    return metrics.render()
@@ -0,0 +1,15 @@
+import asyncio
+
+from tortoise import Tortoise
+
+
+def run_with_db(test):
+    """Run the coroutine function `test` against a fresh in-memory database."""
+    async def main():
+        await Tortoise.init(db_url='sqlite://:memory:', modules={'models': ['user.models']})
+        await Tortoise.generate_schemas()
+        try:
+            await test()
+        finally:
+            await Tortoise.close_connections()
+    asyncio.run(main())
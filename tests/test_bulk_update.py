@@ -0,0 +1,59 @@
+from tests import run_with_db
+from user.api import bulk_update_person
+from user.models import User
+from user.pydentic_modules import UpdatePerson
+
+
+async def create_user(email, phone):
+    return await User.create(email=email, name='a', phone=phone, password='hash')
+
+
+def change(id, email, phone):
+    return UpdatePerson(id=id, name='changed', email=email, phone=phone)
+
+
+def test_bulk_update_reports_each_id():
+    async def test():
+        a = await create_user('a@x.com', '1111111111')
+        b = await create_user('b@x.com', '2222222222')
+        c = await create_user('c@x.com', '3333333333')
+        d = await create_user('d@x.com', '4444444444')
+        e = await create_user('e@x.com', '5555555555')
+        response = await bulk_update_person([
+            change(a.id, 'a@x.com', 1111111111),      # keeps its own email and phone
+            change(b.id, 'b@x.com', 123),
+            change(c.id, 'c2@x.com', 12345678901),
+            change(d.id, 'a@x.com', 4444444444),      # email of another user
+            change(e.id, 'e@x.com', 1111111111),      # phone of another user
+            change(999, 'z@x.com', 9999999999),
+        ])
+        assert response['results'] == [
+            {'id': a.id, 'status': 'updated'},
+            {'id': b.id, 'status': 'error', 'message': 'Phone number must be exactly 10 digits'},
+            {'id': c.id, 'status': 'error', 'message': 'Phone number must be exactly 10 digits'},
+            {'id': d.id, 'status': 'error', 'message': 'Email already exists'},
+            {'id': e.id, 'status': 'error', 'message': 'Phone number already exists'},
+            {'id': 999, 'status': 'not found'},
+        ]
+        assert (response['updated'], response['failed']) == (1, 4)
+        assert await User.filter(name='changed').values_list('id', flat=True) == [a.id]
+    run_with_db(test)
+
+
+def test_bulk_update_reports_values_repeated_in_the_batch():
+    async def test():
+        a = await create_user('a@x.com', '1111111111')
+        b = await create_user('b@x.com', '2222222222')
+        c = await create_user('c@x.com', '3333333333')
+        response = await bulk_update_person([
+            change(a.id, 'new@x.com', 4444444444),
+            change(b.id, 'new@x.com', 5555555555),
+            change(c.id, 'c@x.com', 4444444444),
+        ])
+        assert [(result['id'], result['status'], result.get('message')) for result in response['results']] == [
+            (a.id, 'updated', None),
+            (b.id, 'error', 'Email already exists'),
+            (c.id, 'error', 'Phone number already exists'),
+        ]
+        assert await User.get(id=a.id).values('email', 'phone') == {'email': 'new@x.com', 'phone': '4444444444'}
+    run_with_db(test)
@@ -0,0 +1,145 @@
+import asyncio
+
+import pytest
+
+from tests import run_with_db
+from user import cache
+from user.cache import MemoryBackend, UserCache
+from user.models import User
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+class CountingCache(UserCache):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fetches = 0
+
+    async def fetch(self, field, value):
+        self.fetches += 1
+        return await super().fetch(field, value)
+
+
+async def create_user(email='a@x.com', phone='1234567890'):
+    return await User.create(email=email, name='a', phone=phone, password='hash')
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache, 'time', clock)
+    return clock
+
+
+def test_memory_backend_expires_entries(clock):
+    async def test():
+        backend = MemoryBackend()
+        await backend.set('key', 'value', ttl=10)
+        clock.now += 9
+        assert await backend.get('key') == 'value'
+        clock.now += 2
+        assert await backend.get('key') is None
+        assert len(backend) == 0
+    asyncio.run(test())
+
+
+def test_memory_backend_evicts_least_recently_used():
+    async def test():
+        backend = MemoryBackend(max_size=2)
+        await backend.set('a', 1, ttl=60)
+        await backend.set('b', 2, ttl=60)
+        await backend.get('a')
+        await backend.set('c', 3, ttl=60)
+        assert await backend.get('b') is None
+        assert await backend.get('a') == 1
+        assert await backend.get('c') == 3
+        assert backend.evictions == 1
+    asyncio.run(test())
+
+
+def test_hit_after_miss_skips_the_database():
+    async def test():
+        user_cache = CountingCache()
+        user = await create_user()
+        assert (await user_cache.get_user('email', 'a@x.com')).id == user.id
+        assert (await user_cache.get_user('phone', '1234567890')).id == user.id
+        assert (await user_cache.get_user('id', user.id)).email == 'a@x.com'
+        assert user_cache.fetches == 1
+        assert user_cache.stats()['hits'] == 2
+    run_with_db(test)
+
+
+def test_misses_are_cached_until_invalidated():
+    async def test():
+        user_cache = CountingCache()
+        assert await user_cache.get_user('email', 'a@x.com') is None
+        assert await user_cache.get_user('email', 'a@x.com') is None
+        assert user_cache.fetches == 1
+        assert user_cache.negative_hits == 1
+
+        user = await create_user()
+        await user_cache.invalidate(id=user.id, email=user.email, phone=user.phone)
+        assert (await user_cache.get_user('email', 'a@x.com')).id == user.id
+    run_with_db(test)
+
+
+def test_negative_entries_expire(clock):
+    async def test():
+        user_cache = CountingCache(negative_ttl=5)
+        assert await user_cache.get_user('email', 'a@x.com') is None
+        await create_user()
+        clock.now += 6
+        assert await user_cache.get_user('email', 'a@x.com') is not None
+        assert user_cache.fetches == 2
+    run_with_db(test)
+
+
+def test_changed_email_does_not_resolve_through_stale_pointer():
+    async def test():
+        user_cache = CountingCache()
+        user = await create_user()
+        await user_cache.get_user('email', 'a@x.com')
+
+        await User.filter(id=user.id).update(email='b@x.com')
+        await user_cache.invalidate(id=user.id, email='b@x.com')
+        assert await user_cache.get_user('email', 'a@x.com') is None
+        assert (await user_cache.get_user('email', 'b@x.com')).id == user.id
+    run_with_db(test)
+
+
+def test_deleted_user_is_not_cached_again_by_a_racing_lookup():
+    async def test():
+        user = await create_user()
+
+        class RacingCache(CountingCache):
+            async def fetch(self, field, value):
+                row = await super().fetch(field, value)
+                if self.fetches == 1:
+                    # the user is deleted while this lookup waits on the database
+                    await User.filter(id=user.id).delete()
+                    await self.invalidate(id=user.id)
+                return row
+
+        user_cache = RacingCache()
+        assert await user_cache.get_user('email', 'a@x.com') is not None
+        assert await user_cache.get_user('email', 'a@x.com') is None
+        assert user_cache.fetches == 2
+    run_with_db(test)
+
+
+def test_clear_drops_everything():
+    async def test():
+        user_cache = CountingCache()
+        await create_user()
+        await user_cache.get_user('email', 'a@x.com')
+        await user_cache.clear()
+        assert len(user_cache.backend) == 0
+        await user_cache.get_user('email', 'a@x.com')
+        assert user_cache.fetches == 2
+    run_with_db(test)
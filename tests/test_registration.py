@@ -0,0 +1,91 @@
+import sqlite3
+
+import pytest
+from tortoise.exceptions import IntegrityError
+
+from tests import run_with_db
+from user.api import bulk_registration
+from user.models import User
+from user.pydentic_modules import Person
+from user.queries import duplicate_field
+
+
+class UniqueViolationError(Exception):
+    """Stands in for asyncpg.exceptions.UniqueViolationError."""
+
+    def __init__(self, column_name=None, detail=None, constraint_name=None):
+        super().__init__('duplicate key value violates unique constraint')
+        self.column_name = column_name
+        self.detail = detail
+        self.constraint_name = constraint_name
+
+
+@pytest.mark.parametrize('original, field', [
+    (UniqueViolationError(column_name='phone'), 'phone'),
+    # the duplicated value names the other column and must not be matched
+    (UniqueViolationError(detail='Key (email)=(phone@x.com) already exists.'), 'email'),
+    (UniqueViolationError(detail='Key (phone)=(1234567890) already exists.', constraint_name='user_email_key'), 'phone'),
+    (UniqueViolationError(constraint_name='user_phone_key'), 'phone'),
+    (UniqueViolationError(constraint_name='user_email_key'), 'email'),
+    (UniqueViolationError(constraint_name='user_email_phone_key'), None),
+    (sqlite3.IntegrityError('UNIQUE constraint failed: user.email'), 'email'),
+    (sqlite3.IntegrityError('UNIQUE constraint failed: user.name'), None),
+    (sqlite3.IntegrityError('NOT NULL constraint failed: user.phone'), None),
+])
+def test_duplicate_field(original, field):
+    assert duplicate_field(IntegrityError(original)) == field
+
+
+def test_duplicate_field_from_sqlite_insert():
+    async def test():
+        await User.create(email='phone@x.com', name='a', phone='1234567890', password='hash')
+        with pytest.raises(IntegrityError) as error:
+            await User.create(email='phone@x.com', name='b', phone='1234567891', password='hash')
+        assert duplicate_field(error.value) == 'email'
+        with pytest.raises(IntegrityError) as error:
+            await User.create(email='email@x.com', name='b', phone='1234567890', password='hash')
+        assert duplicate_field(error.value) == 'phone'
+    run_with_db(test)
+
+
+def person(email, phone):
+    return Person(email=email, phone=phone, name='a', password='secret')
+
+
+def test_bulk_registration_reports_each_row():
+    async def test():
+        existing = await User.create(email='taken@x.com', name='a', phone='1111111111', password='hash')
+        response = await bulk_registration([
+            person('new1@x.com', 2222222222),
+            person('short@x.com', 123),
+            person('new1@x.com', 3333333333),    # email repeated in the batch
+            person('new2@x.com', 2222222222),    # phone repeated in the batch
+            person('taken@x.com', 4444444444),   # email of an existing user
+            person('new3@x.com', 1111111111),    # phone of an existing user
+            person('new4@x.com', 5555555555),
+        ])
+        assert [(result['index'], result['status'], result.get('message')) for result in response['results']] == [
+            (0, 'created', None),
+            (1, 'error', 'Phone number must be exactly 10 digits'),
+            (2, 'error', 'Email already exists'),
+            (3, 'error', 'Phone number already exists'),
+            (4, 'error', 'Email already exists'),
+            (5, 'error', 'Phone number already exists'),
+            (6, 'created', None),
+        ]
+        assert (response['created'], response['failed']) == (2, 5)
+
+        rows = await User.exclude(id=existing.id).order_by('id').values('id', 'email', 'phone')
+        assert [(row['email'], row['phone']) for row in rows] == [('new1@x.com', '2222222222'),
+                                                                  ('new4@x.com', '5555555555')]
+        assert [response['results'][0]['id'], response['results'][6]['id']] == [row['id'] for row in rows]
+    run_with_db(test)
+
+
+def test_bulk_registration_rejects_oversized_batches(monkeypatch):
+    async def test():
+        monkeypatch.setattr('user.api.MAX_BULK_REGISTRATION', 1)
+        response = await bulk_registration([person('a@x.com', 1234567890), person('b@x.com', 1234567891)])
+        assert response.status_code == 413
+        assert await User.all().count() == 0
+    run_with_db(test)
@@ -1,12 +1,23 @@
-from fastapi import APIRouter, Request, Form, status
+from fastapi import APIRouter, Request, Form, Query, status
 from fastapi.templating import Jinja2Templates
 from fastapi.responses import HTMLResponse, RedirectResponse
+from typing import List
+
+from tortoise.exceptions import IntegrityError
+from tortoise.expressions import Q
+from tortoise.transactions import in_transaction
+
 from .models import *
 from json import JSONEncoder
 from fastapi.encoders import jsonable_encoder
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, ORJSONResponse, StreamingResponse
+import orjson
 
-from .pydentic_modules import Person, DeletePerson, UpdatePerson, LoginPerson,Token
+from .pydentic_modules import Person, DeletePerson, UpdatePerson, LoginPerson,Token, UserOut, UserProjection
+from .cache import user_cache
+from .passwords import hasher, get_password_hash, verify_password
+from .queries import (BULK_CHUNK_SIZE, DUPLICATE_MESSAGES, MAX_BULK_REGISTRATION, MAX_PAGE_SIZE, chunked, duplicate_field,
+                      fetch_page, iter_users, parse_fields, search_users)
 
 app = APIRouter()
 
@@ -18,36 +29,90 @@ async def registration(data:Person):
     if len(phone_number) != 10:
         return {"status": "error", "message":"Phone number must be exactly 10 digits"}
     
-    if await User.exists(phone = phone_number):
-        return {"status": "error", "message":"Phone number already exists"}
-    
-    elif await User.exists(email = data.email):
-        return {"status": "error", "message":"Email already exists"}
-    
-    else:
+    # a single INSERT; the unique indexes on phone and email catch duplicates
+    try:
         user_object = await User.create(email = data.email, 
                                         name=data.name, 
-                                        password=data.password, 
+                                        password=await get_password_hash(data.password), 
                                         phone=phone_number)
-        return user_object
-    
+    except IntegrityError as error:
+        field = duplicate_field(error)
+        if field is None:
+            raise
+        return {"status": "error", "message": DUPLICATE_MESSAGES[field]}
+    await user_cache.invalidate(id=user_object.id, email=user_object.email, phone=user_object.phone)
+    return UserOut(id=user_object.id, email=user_object.email, name=user_object.name, phone=user_object.phone)
+
+@app.post('/bulk-registration/')
+async def bulk_registration(data: List[Person]):
+    if len(data) > MAX_BULK_REGISTRATION:
+        return JSONResponse({"status": "error", "message": f"At most {MAX_BULK_REGISTRATION} users per request"},
+                            status_code=413)
+    results = [None] * len(data)
+    candidates = []
+    seen_phones, seen_emails = set(), set()
+    for index, person in enumerate(data):
+        phone_number = str(person.phone)
+        if len(phone_number) != 10:
+            results[index] = {"index": index, "status": "error", "message": "Phone number must be exactly 10 digits"}
+        elif phone_number in seen_phones:
+            results[index] = {"index": index, "status": "error", "message": DUPLICATE_MESSAGES['phone']}
+        elif person.email in seen_emails:
+            results[index] = {"index": index, "status": "error", "message": DUPLICATE_MESSAGES['email']}
+        else:
+            seen_phones.add(phone_number)
+            seen_emails.add(person.email)
+            candidates.append((index, person, phone_number))
+
+    # report rows clashing with existing users before paying for their bcrypt hashes
+    taken_phones, taken_emails = set(), set()
+    for chunk in chunked(candidates, BULK_CHUNK_SIZE):
+        rows = await User.filter(Q(email__in=[person.email for _, person, _ in chunk]) |
+                                 Q(phone__in=[phone for _, _, phone in chunk])).values('email', 'phone')
+        taken_phones.update(row['phone'] for row in rows)
+        taken_emails.update(row['email'] for row in rows)
+    new_users = []
+    for index, person, phone_number in candidates:
+        if phone_number in taken_phones:
+            results[index] = {"index": index, "status": "error", "message": DUPLICATE_MESSAGES['phone']}
+        elif person.email in taken_emails:
+            results[index] = {"index": index, "status": "error", "message": DUPLICATE_MESSAGES['email']}
+        else:
+            new_users.append((index, person, phone_number))
+
+    hashes = await hasher.hash_many(person.password for _, person, _ in new_users)
+    async with in_transaction():
+        # ON CONFLICT DO NOTHING covers rows inserted concurrently since the check above
+        await User.bulk_create([User(email=person.email, name=person.name, phone=phone_number, password=password)
+                                for (_, person, phone_number), password in zip(new_users, hashes)],
+                               batch_size=BULK_CHUNK_SIZE, ignore_conflicts=True)
+
+    created = {}
+    for chunk in chunked(new_users, BULK_CHUNK_SIZE):
+        rows = await User.filter(email__in=[person.email for _, person, _ in chunk]).values('id', 'email', 'phone')
+        created.update((row['email'], row) for row in rows)
+    for index, person, phone_number in new_users:
+        row = created.get(person.email)
+        if row and row['phone'] == phone_number:
+            results[index] = {"index": index, "status": "created", "id": row['id']}
+        else:
+            results[index] = {"index": index, "status": "error", "message": "User already exists"}
+    await user_cache.invalidate_many(ids=[row['id'] for row in created.values()],
+                                     emails=created.keys(),
+                                     phones=[row['phone'] for row in created.values()])
+
+    return {"created": sum(result['status'] == 'created' for result in results),
+            "failed": sum(result['status'] == 'error' for result in results),
+            "results": results}
 
-from passlib.context import CryptContext
 from fastapi_login import LoginManager
 SECRET = 'your-secret-key'    
 
 manager = LoginManager(SECRET, token_url='/auth/token')
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-def get_password_hash(password):
-    return pwd_context.hash(password)
 
 @manager.user_loader()  
 async def load_user(email: str):
-    if await User.exists(email=email):
-        user = await User.get(email=email)   
-        return user
+    return await user_cache.get_user('email', email)
 
 # Login in users
 @app.post('/login/', )
@@ -58,7 +123,7 @@ async def login(data: LoginPerson,
  
     if not user:
         return JSONResponse({'status': False, 'message': 'User not Registered'}, status_code=403)
-    elif not verify_password(data.password, user.password):
+    elif not await verify_password(data.password, user.password):
         return JSONResponse({'status': False, 'message': 'Invalid password'}, status_code=403)
     access_token = manager.create_access_token(
         data={'sub': dict({"id":jsonable_encoder(user.id)}), }
@@ -71,19 +136,147 @@ async def login(data: LoginPerson,
 @app.delete("/delete-person/")
 async def delete_person(data:DeletePerson):
     await User.filter(id=data.id).delete()
+    await user_cache.invalidate(id=data.id)
     return {"User deleted successfully"}
 
 @app.put("/update-person/")
 async def update_person(data:UpdatePerson):
-    person = await User.get(id=data.id).update(name=data.name, email=data.email, phone=data.phone)
+    person = await User.filter(id=data.id).update(name=data.name, email=data.email, phone=data.phone)
+    await user_cache.invalidate(id=data.id, email=data.email, phone=data.phone)
     return person
 
-@app.get('/show-person/')
-async def show_person():
-    users = await User.all()
-    return  users 
+@app.delete("/bulk-delete-person/")
+async def bulk_delete_person(data: List[DeletePerson]):
+    ids = list(dict.fromkeys(person.id for person in data))
+    deleted = set()
+    async with in_transaction():
+        for chunk in chunked(ids, BULK_CHUNK_SIZE):
+            found = await User.filter(id__in=chunk).values_list('id', flat=True)
+            await User.filter(id__in=found).delete()
+            deleted.update(found)
+    await user_cache.invalidate_many(ids=deleted)
+    return {"deleted": len(deleted),
+            "results": [{"id": id, "status": "deleted" if id in deleted else "not found"} for id in ids]}
+
+@app.put("/bulk-update-person/")
+async def bulk_update_person(data: List[UpdatePerson]):
+    changes = {person.id: person for person in data}
+    ids = list(changes)
+    results = {}
+    candidates = []
+    seen_phones, seen_emails = set(), set()
+    for id, person in changes.items():
+        phone_number = str(person.phone)
+        # a longer phone would overflow the column and fail the whole batch
+        if len(phone_number) != 10:
+            results[id] = {"id": id, "status": "error", "message": "Phone number must be exactly 10 digits"}
+        elif phone_number in seen_phones:
+            results[id] = {"id": id, "status": "error", "message": DUPLICATE_MESSAGES['phone']}
+        elif person.email in seen_emails:
+            results[id] = {"id": id, "status": "error", "message": DUPLICATE_MESSAGES['email']}
+        else:
+            seen_phones.add(phone_number)
+            seen_emails.add(person.email)
+            candidates.append((id, person, phone_number))
+
+    # values held by another user, as the table stands before the update, so swapping
+    # emails or phones between two users in one batch is reported as a clash
+    phone_owners, email_owners = {}, {}
+    for chunk in chunked(candidates, BULK_CHUNK_SIZE):
+        rows = await User.filter(Q(email__in=[person.email for _, person, _ in chunk]) |
+                                 Q(phone__in=[phone for _, _, phone in chunk])).values('id', 'email', 'phone')
+        phone_owners.update((row['phone'], row['id']) for row in rows)
+        email_owners.update((row['email'], row['id']) for row in rows)
+    valid = []
+    for id, person, phone_number in candidates:
+        if phone_owners.get(phone_number, id) != id:
+            results[id] = {"id": id, "status": "error", "message": DUPLICATE_MESSAGES['phone']}
+        elif email_owners.get(person.email, id) != id:
+            results[id] = {"id": id, "status": "error", "message": DUPLICATE_MESSAGES['email']}
+        else:
+            valid.append(id)
+
+    updated = []
+    try:
+        async with in_transaction():
+            for chunk in chunked(valid, BULK_CHUNK_SIZE):
+                users = await User.filter(id__in=chunk)
+                for user in users:
+                    person = changes[user.id]
+                    user.name, user.email, user.phone = person.name, person.email, str(person.phone)
+                if users:
+                    await User.bulk_update(users, fields=['name', 'email', 'phone'], batch_size=BULK_CHUNK_SIZE)
+                updated.extend(user.id for user in users)
+    except IntegrityError as error:
+        field = duplicate_field(error)
+        if field is None:
+            raise
+        # a concurrent write took a value after the check above; the whole batch is rolled back
+        for id in valid:
+            results[id] = {"id": id, "status": "error", "message": f"{DUPLICATE_MESSAGES[field]}, nothing was updated"}
+        return {"updated": 0, "failed": len(results), "results": [results[id] for id in ids]}
+    await user_cache.invalidate_many(ids=updated,
+                                     emails=[changes[id].email for id in updated],
+                                     phones=[str(changes[id].phone) for id in updated])
+    updated = set(updated)
+    for id in valid:
+        results[id] = {"id": id, "status": "updated" if id in updated else "not found"}
+    return {"updated": len(updated),
+            "failed": sum(result['status'] == 'error' for result in results.values()),
+            "results": [results[id] for id in ids]}
+
+@app.get('/show-person/', response_model=List[UserProjection])
+async def show_person(limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+                      after: int = None,
+                      fields: str = None):
+    users = await fetch_page(limit, after, parse_fields(fields))
+    # the rows come from .values() already projected, so skip jsonable_encoder and dump them directly;
+    # response_model only documents the shape
+    response = ORJSONResponse(users)
+    if len(users) == limit:
+        response.headers['X-Next-After'] = str(users[-1]['id'])
+    return  response 
+
+@app.get('/users/search', response_model=List[UserOut],
+         responses={400: {'description': 'None of email, phone or name was given'}})
+async def search_person(email: str = None,
+                        phone: str = None,
+                        name: str = Query(None, min_length=1, description='case-insensitive name prefix'),
+                        limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+                        after: int = None):
+    if email is None and phone is None and name is None:
+        return JSONResponse({'status': 'error', 'message': 'Give at least one of email, phone or name'}, status_code=400)
+    users = await search_users(limit, after, email=email, phone=phone, name=name)
+    response = ORJSONResponse(users)
+    if len(users) == limit:
+        response.headers['X-Next-After'] = str(users[-1]['id'])
+    return response
+
+@app.get('/show-person/export/')
+async def export_person(fields: str = None):
+    projection = parse_fields(fields)
+
+    async def rows():
+        async for user in iter_users(projection):
+            yield orjson.dumps(user) + b'\n'
+
+    return StreamingResponse(rows(), media_type='application/x-ndjson')
+
+@app.get('/hasher-stats/')
+async def hasher_stats():
+    return hasher.stats()
+
+@app.get('/cache-stats/')
+async def cache_stats():
+    return user_cache.stats()
 
 @app.delete('/alldelete/')
 async def delete_all():
-    await User.all().delete()
+    # delete in id batches so no single statement locks the whole table for long
+    while True:
+        ids = await User.all().order_by('id').limit(BULK_CHUNK_SIZE).values_list('id', flat=True)
+        if not ids:
+            break
+        await User.filter(id__in=ids).delete()
+    await user_cache.clear()
     return {'All Users Deleted'}
\ No newline at end of file
@@ -0,0 +1,162 @@
+# user cache for the login loaders, keyed by id, email and phone
+
+import time
+from collections import OrderedDict
+
+from settings import settings
+
+from .models import User
+
+USER_FIELDS = ('id', 'email', 'name', 'phone', 'password')
+LOOKUP_FIELDS = ('id', 'email', 'phone')
+NOT_FOUND = 0  # user ids start at 1, so 0 marks a cached miss
+
+
+class CacheBackend:
+    """Storage used by UserCache.
+
+    Values are plain ints and dicts so a shared store (redis, memcached) can
+    back several uvicorn workers; subclass this and pass it to UserCache.
+    """
+
+    async def get(self, key):
+        raise NotImplementedError
+
+    async def set(self, key, value, ttl):
+        raise NotImplementedError
+
+    async def delete(self, *keys):
+        raise NotImplementedError
+
+    async def clear(self):
+        raise NotImplementedError
+
+
+class MemoryBackend(CacheBackend):
+    """Per-process LRU with a TTL on every entry."""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.evictions = 0
+        self._data = OrderedDict()
+
+    async def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key, value, ttl):
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, *keys):
+        for key in keys:
+            self._data.pop(key, None)
+
+    async def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class UserCache:
+    """Caches user rows by id and maps email/phone to that id.
+
+    Email and phone entries only point at an id, and the row they lead to is
+    checked against the lookup value, so a changed email or phone can never
+    return the wrong user even if the old pointer is still cached.
+    """
+
+    def __init__(self, backend=None, ttl=60, negative_ttl=5):
+        self.backend = backend or MemoryBackend()
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+        # bumped by every invalidation in this process, so a lookup that raced a write does not
+        # re-cache stale data; writes from other workers on a shared backend are bounded by the TTL
+        self.generation = 0
+
+    @staticmethod
+    def key(field, value):
+        return f'user:{field}:{value}'
+
+    async def get_user(self, field, value):
+        """Return the User whose `field` equals `value`, or None, querying the DB at most once."""
+        if field not in LOOKUP_FIELDS:
+            raise ValueError(f'cannot look users up by {field}')
+        user_id = value if field == 'id' else await self.backend.get(self.key(field, value))
+        row = None
+        if user_id is not None and user_id != NOT_FOUND:
+            row = await self.backend.get(self.key('id', user_id))
+        if user_id == NOT_FOUND or row == NOT_FOUND:
+            self.negative_hits += 1
+            return None
+        if row is not None and str(row[field]) == str(value):
+            self.hits += 1
+            return User._init_from_db(**row)
+
+        self.misses += 1
+        generation = self.generation
+        row = await self.fetch(field, value)
+        if generation == self.generation:
+            if row is None:
+                await self.backend.set(self.key(field, value), NOT_FOUND, self.negative_ttl)
+            else:
+                await self.store(row)
+        return None if row is None else User._init_from_db(**row)
+
+    async def fetch(self, field, value):
+        return await User.filter(**{field: value}).first().values(*USER_FIELDS)
+
+    async def store(self, row):
+        await self.backend.set(self.key('id', row['id']), row, self.ttl)
+        await self.backend.set(self.key('email', row['email']), row['id'], self.ttl)
+        await self.backend.set(self.key('phone', row['phone']), row['id'], self.ttl)
+
+    async def invalidate(self, id=None, email=None, phone=None):
+        """Drop whatever is cached for these values; call after any write to the user table."""
+        keys = [self.key(field, value)
+                for field, value in (('id', id), ('email', email), ('phone', phone))
+                if value is not None]
+        self.generation += 1
+        await self.backend.delete(*keys)
+
+    async def invalidate_many(self, ids=(), emails=(), phones=()):
+        self.generation += 1
+        await self.backend.delete(*[self.key('id', value) for value in ids],
+                                  *[self.key('email', value) for value in emails],
+                                  *[self.key('phone', value) for value in phones])
+
+    async def clear(self):
+        self.generation += 1
+        await self.backend.clear()
+
+    def stats(self):
+        lookups = self.hits + self.negative_hits + self.misses
+        stats = {
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'misses': self.misses,
+            'hit_ratio': round((self.hits + self.negative_hits) / lookups, 4) if lookups else 0.0,
+        }
+        if isinstance(self.backend, MemoryBackend):
+            stats.update(size=len(self.backend), max_size=self.backend.max_size,
+                         evictions=self.backend.evictions)
+        return stats
+
+
+user_cache = UserCache(MemoryBackend(max_size=settings.user_cache_size),
+                       ttl=settings.user_cache_ttl,
+                       negative_ttl=settings.user_cache_negative_ttl)
@@ -2,12 +2,37 @@
 
 from tortoise.models import Model
 from tortoise import Tortoise, fields
+from tortoise.indexes import Index
+
+
+class LowerIndex(Index):
+    # index on LOWER(field) for case-insensitive prefix search.
+    # postgres: the expression is exactly what tortoise's __startswith on a Lower()
+    # annotation emits, and the pattern opclass lets LIKE 'abc%' use it under any collation.
+    # sqlite: LIKE never uses expression indexes, so search_users adds a range on LOWER(field).
+    def get_sql(self, schema_generator, model, safe):
+        column = schema_generator.quote(self.fields[0])
+        if schema_generator.DIALECT == 'postgres':
+            expression = f'(CAST(LOWER({column}) AS VARCHAR)) varchar_pattern_ops'
+        else:
+            expression = f'(LOWER({column}))'
+        return 'CREATE INDEX {exists}{name} ON {table} ({expression});'.format(
+            exists='IF NOT EXISTS ' if safe else '',
+            name=schema_generator.quote(self.name),
+            table=schema_generator.quote(model._meta.db_table),
+            expression=expression,
+        )
+
 
 class User(Model):
     id = fields.IntField(pk=True)
+    # email and phone are looked up exactly; their unique constraints double as the indexes
     email = fields.CharField(255, unique = True)
     name = fields.CharField(50)
-    phone = fields.CharField(10)
+    phone = fields.CharField(10, unique = True)
     password = fields.CharField(250)
 
+    class Meta:
+        indexes = (LowerIndex(fields=('name',), name='idx_user_name_lower'),)
+
 Tortoise.init_models(['user.models'], 'models')
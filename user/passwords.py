@@ -0,0 +1,156 @@
+# password hashing service shared by the api and template routers
+
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from settings import settings
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+def _hash(password):
+    return pwd_context.hash(password)
+
+def _verify(plain_password, hashed_password):
+    try:
+        return pwd_context.verify(plain_password, hashed_password)
+    except (ValueError, TypeError):
+        # stored value is not a recognised hash
+        return False
+
+def _run_timed(func, *args):
+    # runs on the worker; monotonic() is host-wide, so the start time can be
+    # compared with the queue time even from another process
+    started = time.monotonic()
+    result = func(*args)
+    return started, time.monotonic() - started, result
+
+
+class PasswordHasher:
+    """Runs bcrypt on a worker pool so it never blocks the event loop.
+
+    At most `max_pending` jobs may be queued or running at once; any job
+    beyond that is rejected with a 503 instead of piling up behind the pool.
+    Bulk hashing never has more than `bulk_share` jobs in flight, so a large
+    batch leaves the rest of the pool to interactive logins.
+    """
+
+    def __init__(self, executor='thread', max_workers=None, max_pending=None, bulk_share=None):
+        self.executor_kind = executor
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_pending = max_pending or self.max_workers * 4
+        self.bulk_share = bulk_share or max(1, self.max_workers // 2)
+        self._executor = None
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.running = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds = 0.0
+        self.run_seconds = 0.0
+        self.max_run_seconds = 0.0
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            if self.executor_kind == 'process':
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                    thread_name_prefix='password-hasher')
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _tracked(self, func, *args):
+        # thread pool only: counts the jobs actually running on a worker
+        with self._lock:
+            self.running += 1
+        try:
+            return _run_timed(func, *args)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    async def _submit(self, func, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                                detail='Too many password operations in progress, try again later',
+                                headers={'Retry-After': '1'})
+        self.pending += 1
+        queued_at = time.monotonic()
+        loop = asyncio.get_running_loop()
+        try:
+            if self.executor_kind == 'process':
+                started, elapsed, result = await loop.run_in_executor(self.executor, _run_timed, func, *args)
+            else:
+                started, elapsed, result = await loop.run_in_executor(self.executor, self._tracked, func, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+        self.wait_seconds += max(started - queued_at, 0.0)
+        self.run_seconds += elapsed
+        self.max_run_seconds = max(self.max_run_seconds, elapsed)
+        return result
+
+    @property
+    def running_jobs(self):
+        if self.executor_kind == 'process':
+            # worker processes cannot report in; a pool runs every pending job up to its size
+            return min(self.pending, self.max_workers)
+        return self.running
+
+    async def hash(self, password):
+        return await self._submit(_hash, password)
+
+    async def verify(self, plain_password, hashed_password):
+        return await self._submit(_verify, plain_password, hashed_password)
+
+    async def hash_many(self, passwords):
+        # one password per job and at most bulk_share jobs queued at once, so a
+        # login submitted mid-batch waits for one bcrypt round at most
+        semaphore = asyncio.Semaphore(self.bulk_share)
+
+        async def hash_one(password):
+            async with semaphore:
+                return await self._submit(_hash, password)
+
+        return await asyncio.gather(*(hash_one(password) for password in passwords))
+
+    def stats(self):
+        return {
+            'executor': self.executor_kind,
+            'max_workers': self.max_workers,
+            'max_pending': self.max_pending,
+            'pending': self.pending,
+            'running': self.running_jobs,
+            'queue_depth': self.pending - self.running_jobs,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'avg_wait_ms': round(self.wait_seconds / self.completed * 1000, 3) if self.completed else 0.0,
+            'avg_run_ms': round(self.run_seconds / self.completed * 1000, 3) if self.completed else 0.0,
+            'max_run_ms': round(self.max_run_seconds * 1000, 3),
+        }
+
+
+hasher = PasswordHasher(executor=settings.password_hasher_executor,
+                        max_workers=settings.password_hasher_workers,
+                        max_pending=settings.password_hasher_max_pending,
+                        bulk_share=settings.password_hasher_bulk_share)
+
+
+async def verify_password(plain_password, hashed_password):
+    return await hasher.verify(plain_password, hashed_password)
+
+async def get_password_hash(password):
+    return await hasher.hash(password)
@@ -1,5 +1,7 @@
 # serializer
 
+from typing import Optional
+
 from pydantic import BaseModel
 
 
@@ -23,6 +25,21 @@ class LoginPerson(BaseModel):
     password:str
 
 
+class UserOut(BaseModel):
+    id: int
+    email:str
+    name:str
+    phone:str
+
+
+# /show-person/ rows: `fields=` can leave out anything but id
+class UserProjection(BaseModel):
+    id: int
+    email: Optional[str] = None
+    name: Optional[str] = None
+    phone: Optional[str] = None
+
+
 class Token(BaseModel):
     access_token: str
     token_type: str = "bearer"
\ No newline at end of file
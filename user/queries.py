@@ -0,0 +1,100 @@
+# query helpers shared by the api and template routers
+
+import re
+
+from fastapi import HTTPException
+from tortoise import connections
+from tortoise.functions import Lower
+
+from settings import settings
+
+from .models import User
+
+PUBLIC_FIELDS = ('id', 'email', 'name', 'phone')
+MAX_PAGE_SIZE = 1000
+EXPORT_BATCH_SIZE = 1000
+BULK_CHUNK_SIZE = settings.bulk_chunk_size
+MAX_BULK_REGISTRATION = settings.bulk_registration_max_size
+
+
+def parse_fields(fields):
+    """Turn a comma separated `fields` query value into a projection; id is always included."""
+    if not fields:
+        return PUBLIC_FIELDS
+    names = [name.strip() for name in fields.split(',') if name.strip()]
+    unknown = [name for name in names if name not in PUBLIC_FIELDS]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+    return ('id',) + tuple(name for name in PUBLIC_FIELDS if name in names and name != 'id')
+
+
+async def fetch_page(limit, after=None, fields=PUBLIC_FIELDS):
+    query = User.all()
+    if after is not None:
+        query = query.filter(id__gt=after)
+    return await query.order_by('id').limit(limit).values(*fields)
+
+
+async def search_users(limit, after=None, email=None, phone=None, name=None):
+    """Exact email/phone lookup and case-insensitive name prefix search, keyset-paginated on id."""
+    query = User.all()
+    if email is not None:
+        query = query.filter(email=email)
+    if phone is not None:
+        query = query.filter(phone=phone)
+    if name:
+        prefix = name.lower()
+        # LOWER(name) LIKE 'abc%', served by idx_user_name_lower on postgres
+        query = query.annotate(name_lower=Lower('name')).filter(name_lower__startswith=prefix)
+        if connections.get('default').capabilities.dialect == 'sqlite' and ord(prefix[-1]) < 0x10FFFF:
+            # sqlite only uses an expression index for ranges, not LIKE; with binary
+            # ordering every match lies in [prefix, next prefix)
+            upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+            query = query.filter(name_lower__gte=prefix, name_lower__lt=upper)
+    if after is not None:
+        query = query.filter(id__gt=after)
+    return await query.order_by('id').limit(limit).values(*PUBLIC_FIELDS)
+
+
+async def iter_users(fields=PUBLIC_FIELDS, batch_size=EXPORT_BATCH_SIZE):
+    """Yield every user row, one keyset page at a time, so memory stays flat."""
+    after = None
+    while True:
+        rows = await fetch_page(batch_size, after, fields)
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            break
+        after = rows[-1]['id']
+
+
+DUPLICATE_MESSAGES = {
+    'phone': 'Phone number already exists',
+    'email': 'Email already exists',
+}
+
+
+def duplicate_field(error):
+    """Name the unique column an IntegrityError was raised for, or None.
+
+    Only the column name is read, never the duplicated value, which may itself
+    contain "phone" or "email".
+    """
+    original = error.args[0] if error.args else None
+    # postgres (asyncpg): column_name when set, else detail 'Key (email)=(...) already exists.'
+    # and constraint_name 'user_email_key'
+    column = getattr(original, 'column_name', None)
+    if column is None:
+        match = re.match(r'Key \((\w+)\)=', getattr(original, 'detail', None) or '')
+        if match is None:
+            match = re.fullmatch(rf'{User._meta.db_table}_(\w+)_key', getattr(original, 'constraint_name', None) or '')
+        if match is None:
+            # sqlite: 'UNIQUE constraint failed: user.email'
+            match = re.search(r'UNIQUE constraint failed: \w+\.(\w+)', str(original))
+        column = match.group(1) if match else None
+    return column if column in DUPLICATE_MESSAGES else None
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
@@ -1,8 +1,12 @@
-from fastapi import APIRouter, Request, Form, status
+from fastapi import APIRouter, HTTPException, Request, Form, status
 from fastapi.templating import Jinja2Templates
-from fastapi.responses import HTMLResponse, RedirectResponse
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
+from jinja2 import Environment, FileSystemLoader
+from tortoise.exceptions import IntegrityError
 from .models import *
-from passlib.context import CryptContext
+from .cache import user_cache
+from .passwords import get_password_hash, verify_password
+from .queries import duplicate_field, iter_users
 
 from fastapi_login import LoginManager
 SECRET = 'your-secret-key'
@@ -10,14 +14,9 @@ SECRET = 'your-secret-key'
 
 router = APIRouter()
 templates = Jinja2Templates(directory="user/templates")
+# async environment so large pages can be rendered and sent in chunks
+stream_templates = Environment(loader=FileSystemLoader("user/templates"), autoescape=True, enable_async=True)
 manager = LoginManager(SECRET, token_url='/auth/token')
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-def get_password_hash(password):
-    return pwd_context.hash(password)
 
 
 @router.get('/', response_class = HTMLResponse )
@@ -30,14 +29,16 @@ async def registration(request:Request,
                     email:str = Form(...),
                     password:str = Form(...),
                     phone:str = Form(...)):
-    if await User.filter(email=email).exists():
-        raise HTMLResponse(status_code=409, detail='User already exists')
-    
-    elif await User.filter(phone=phone).exists():
-        raise HTMLResponse(status_code=409, detail='Phone number already exists')
-    else:
-        await User.create(name=name, email=email, phone=phone, password=get_password_hash(password))
-        return RedirectResponse('/table/', status_code = status.HTTP_302_FOUND)
+    try:
+        user = await User.create(name=name, email=email, phone=phone, password=await get_password_hash(password))
+    except IntegrityError as error:
+        if duplicate_field(error) == 'email':
+            raise HTTPException(status_code=409, detail='User already exists')
+        elif duplicate_field(error) == 'phone':
+            raise HTTPException(status_code=409, detail='Phone number already exists')
+        raise
+    await user_cache.invalidate(id=user.id, email=email, phone=phone)
+    return RedirectResponse('/table/', status_code = status.HTTP_302_FOUND)
     
 
 @router.get('/loginshow/',response_class=HTMLResponse)
@@ -46,9 +47,7 @@ async def login_show(request:Request):
 
 @manager.user_loader()
 async def load_user(phone: str):
-    if await User.exists(phone=phone):
-        user = await User.get(phone=phone)
-        return user
+    return await user_cache.get_user('phone', phone)
 
 
 @router.post('/loginuser/')
@@ -59,7 +58,7 @@ async def login(request: Request,
     user = await load_user(Phone)
     if not user:
         return {'USER NOT REGISTERED'}
-    elif not verify_password(Password, user.password):
+    elif not await verify_password(Password, user.password):
         return {'PASSWORD IS WRONG'}
     access_token = manager.create_access_token(
         data=dict(sub=Phone)
@@ -76,12 +75,14 @@ async def login(request: Request,
 
 @router.get('/table/', response_class = HTMLResponse )
 async def table(request:Request):
-    users = await User.all()
-    return templates.TemplateResponse('table.html', {'request': request, 'users':users})
+    template = stream_templates.get_template('table.html')
+    users = iter_users()
+    return StreamingResponse(template.generate_async({'request': request, 'users':users}), media_type='text/html')
 
 @router.get('/deleteuser/{id}', response_class=HTMLResponse)
 async def deleteUser(request:Request, id:int):
     await User.get(id=id).delete()
+    await user_cache.invalidate(id=id)
     return RedirectResponse('/table/',status_code = status.HTTP_302_FOUND)
 
 @router.get('/updateuser/{id}', response_class=HTMLResponse)
@@ -100,6 +101,7 @@ async def updateuser(request:Request, id=int,
         user.email = email
         user.phone = phone
         await user.save()
+        await user_cache.invalidate(id=user.id, email=email, phone=phone)
         print("user save")
         return RedirectResponse('/table/', status_code=status.HTTP_302_FOUND) 
     print("user not found")